@@ -54,8 +54,11 @@ def download_microsoft_symbol(
     MS_USER_AGENT = "Microsoft-Symbol-Server/6.3.0.0"
     url = MS_URL + "/".join([symbol, debugid, symbol[:-1] + "_"])
     session = requests_retry_session()
-    response = session.get(url, headers={"User-Agent": MS_USER_AGENT})
+    response = session.get(url, headers={"User-Agent": MS_USER_AGENT}, stream=True)
     if response.status_code != 200:
+        # Streamed responses aren't implicitly drained, so close this
+        # one deliberately to give the connection back to the pool.
+        response.close()
         logger.info(f"Symbol {symbol}/{debugid} does not exist on msdl.microsoft.com")
         return
 
@@ -78,15 +81,22 @@ def download_microsoft_symbol(
 
     with tempfile.TemporaryDirectory() as tmpdirname:
         filepath = os.path.join(tmpdirname, os.path.basename(url))
-        with open(filepath, "wb") as f:
-            content = response.content
-            if not content.startswith(b"MSCF"):
+        # The 'with response' makes sure the response gets closed even
+        # if we bail out early on the not-a-cabinet-file check below.
+        with response, open(filepath, "wb") as f:
+            # Stream the cabinet file to disk in chunks instead of
+            # holding the whole body in memory and writing it in one go.
+            stream = response.iter_content(chunk_size=1024 * 1024)
+            first_chunk = next(stream, b"")
+            if not first_chunk.startswith(b"MSCF"):
                 error_msg = f"Beginning of content in {url} did not start with 'MSCF'"
                 logger.info(error_msg)
                 download_obj.error = error_msg
                 download_obj.save()
                 return
-            f.write(content)
+            f.write(first_chunk)
+            for chunk in stream:
+                f.write(chunk)
 
         cmd = [
             settings.CABEXTRACT_PATH,
@@ -49,6 +49,14 @@ class S3:
     # The client will likely get a 504 error and will retry soon again.
     S3_PUT_READ_TIMEOUT = values.IntegerValue(30)  # seconds
 
+    # Files larger than this many bytes are uploaded as a concurrent
+    # multipart transfer instead of one single PUT. Smaller files are
+    # still PUT in one request exactly like before.
+    S3_TRANSFER_MULTIPART_THRESHOLD = values.IntegerValue(8 * 1024 * 1024)
+    # How many threads the managed transfer may use for the parts of
+    # one multipart upload.
+    S3_TRANSFER_MAX_CONCURRENCY = values.IntegerValue(10)
+
 
 class Core(AWS, Celery, S3, Configuration):
     """Settings that will never change per-environment."""
@@ -204,6 +212,12 @@ class Core(AWS, Celery, S3, Configuration):
     # this can be cached. This value determines how long we do that caching.
     MEMOIZE_KEY_EXISTING_SIZE_SECONDS = values.IntegerValue(60 * 60 * 24)
 
+    # Every upload checks that the destination bucket actually exists
+    # before doing anything else. Buckets don't come and go, so the
+    # result of that lookup can be cached. This value determines how
+    # long we do that caching.
+    MEMOIZE_BUCKET_EXISTS_SECONDS = values.IntegerValue(60 * 60)
+
     # When we upload a .zip file, we iterate over the content and for each
     # file within (that isn't immediately "ignorable") we kick off a
     # function which figures out what (and how) to process the file.
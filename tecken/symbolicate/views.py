@@ -6,7 +6,7 @@ import datetime
 import time
 import logging
 from bisect import bisect
-from functools import wraps
+from functools import lru_cache, wraps
 from collections import defaultdict
 
 import markus
@@ -95,8 +95,17 @@ def get_symbolication_count_key(prefix, dateobj):
     return f"symbolicationcount:{prefix}:{date}"
 
 
+@lru_cache(maxsize=8)
+def _symbolication_count_key_this_minute(prefix, minute):
+    # The key only contains the *date*, but keying the memoization on
+    # the current minute means we do the strftime() string formatting
+    # at most once a minute per prefix instead of once per request,
+    # while still rolling over to a new key promptly after midnight UTC.
+    return get_symbolication_count_key(prefix, datetime.datetime.utcnow())
+
+
 def increment_symbolication_count(prefix):
-    cache_key = get_symbolication_count_key(prefix, datetime.datetime.utcnow())
+    cache_key = _symbolication_count_key_this_minute(prefix, int(time.time() // 60))
     try:
         cache.incr(cache_key)
     except ValueError:
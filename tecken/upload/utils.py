@@ -11,6 +11,7 @@ import logging
 import socket
 
 import markus
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 from botocore.vendored.requests.exceptions import ReadTimeout
 from cache_memoize import cache_memoize
@@ -27,6 +28,15 @@ metrics = markus.get_metrics("tecken")
 
 downloader = SymbolDownloader(settings.SYMBOL_URLS)
 
+# How boto3's managed transfer should behave. Files under the multipart
+# threshold are still uploaded with one single PUT, but the occasional
+# really large symbol file gets split into parts that are PUT
+# concurrently instead of trickled through one long PUT.
+transfer_config = TransferConfig(
+    multipart_threshold=settings.S3_TRANSFER_MULTIPART_THRESHOLD,
+    max_concurrency=settings.S3_TRANSFER_MAX_CONCURRENCY,
+)
+
 
 class UnrecognizedArchiveFileExtension(ValueError):
     """Happens when you try to extract a file name we don't know how
@@ -56,44 +66,55 @@ def dump_and_extract(root_dir, file_buffer, name):
     The FileMember objects is only ever files. Not the directories.
     """
     if name.lower().endswith(".zip"):
-        zf = zipfile.ZipFile(file_buffer)
-        zf.extractall(root_dir)
-        namelist = zf.namelist()
-        # If there are repeated names in the namelist, dig deeper!
-        if len(set(namelist)) != len(namelist):
-            # It's only a problem any of the files within are of different size
+        with zipfile.ZipFile(file_buffer) as zf:
+            zf.extractall(root_dir)
+            # Walk the zip metadata once. It already knows which entries
+            # are directories and what size each file is, so there's no
+            # need to stat every extracted file from disk just to filter
+            # out the directories.
             sizes = {}
+            members = []
             for info in zf.infolist():
+                if info.is_dir():
+                    continue
                 if info.filename in sizes:
+                    # A repeated name is only a problem if the files
+                    # within are of different size.
                     if info.file_size != sizes[info.filename]:
                         raise DuplicateFileDifferentSize(
-                            "The zipfile buffer contains two files both called "
-                            f"{info.filename} and they have difference sizes "
-                            "({} != {})".format(info.file_size, sizes[info.filename])
+                            "The zipfile buffer contains two files both "
+                            f"called {info.filename} and they have "
+                            "difference sizes ({} != {})".format(
+                                info.file_size, sizes[info.filename]
+                            )
                         )
+                    continue
                 sizes[info.filename] = info.file_size
-        namelist = set(namelist)
+                members.append(
+                    FileMember(
+                        os.path.join(root_dir, info.filename),
+                        info.filename,
+                        info.file_size,
+                    )
+                )
 
     else:
         raise UnrecognizedArchiveFileExtension(os.path.splitext(name)[1])
 
-    return [
-        FileMember(os.path.join(root_dir, filename), filename)
-        for filename in namelist
-        if os.path.isfile(os.path.join(root_dir, filename))
-    ]
+    return members
 
 
 class FileMember:
-    __slots__ = ["path", "name"]
+    __slots__ = ["path", "name", "size"]
 
-    def __init__(self, path, name):
+    def __init__(self, path, name, size):
         self.path = path
         self.name = name
-
-    @property
-    def size(self):
-        return os.stat(self.path).st_size
+        # The size as recorded in the zip metadata, which is the same as
+        # the size of the extracted file but doesn't require a stat of
+        # the path (which, for a rejected entry name, might not even
+        # exist after the sanitized extraction).
+        self.size = size
 
 
 def _key_existing_miss(client, bucket, key):
@@ -263,7 +284,9 @@ def upload_file_upload(
     logger.debug("Uploading file {!r} into {!r}".format(key_name, bucket_name))
     with metrics.timer("upload_put_object"):
         with open(file_path, "rb") as f:
-            client.put_object(Bucket=bucket_name, Key=key_name, Body=f, **extras)
+            client.upload_fileobj(
+                f, bucket_name, key_name, ExtraArgs=extras, Config=transfer_config
+            )
     FileUpload.objects.filter(id=file_upload.id).update(completed_at=timezone.now())
     logger.info(f"Uploaded key {key_name}")
     metrics.incr("upload_file_upload_upload", 1)
@@ -5,6 +5,7 @@
 import re
 import logging
 import fnmatch
+import functools
 import zipfile
 import hashlib
 import os
@@ -15,8 +16,16 @@ import requests
 import markus
 from encore.concurrent.futures.synchronous import SynchronousExecutor
 
+try:
+    import ahocorasick
+except ImportError:
+    # Entirely optional. If it's not installed we fall back to scanning
+    # the file listing with each disallowed snippet individually.
+    ahocorasick = None
+
 from django import http
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 from django.core.exceptions import ImproperlyConfigured
 from django.views.decorators.csrf import csrf_exempt
@@ -38,19 +47,28 @@ from tecken.symbolicate.tasks import invalidate_symbolicate_cache_task
 from tecken.upload.models import Upload
 from tecken.upload.tasks import update_uploads_created_task
 from tecken.upload.forms import UploadByDownloadForm, UploadByDownloadRemoteError
-from tecken.storage import StorageBucket
+from tecken.storage import StorageBucket, get_storage_client
 
 
 logger = logging.getLogger("tecken")
 metrics = markus.get_metrics("tecken")
 
+# Shared session for upload-by-download GETs. Reusing one session (and
+# thereby urllib3's connection pool) means repeated downloads from the
+# same host, e.g. Taskcluster, get HTTP Keep-Alive instead of a fresh
+# TCP+TLS handshake every time.
+download_session = requests.Session()
+
 
 class NoPossibleBucketName(Exception):
     """When you tried to specify a preferred bucket name but it never
     matched to one you can use."""
 
 
-_not_hex_characters = re.compile(r"[^a-f0-9]", re.I)
+# The set of characters that may appear in the debug ID part of a key.
+# Stripping these from the string (see below) is a much cheaper
+# "is it all hex?" test than running a regex over every file listing entry.
+_hex_characters = "0123456789abcdefABCDEF"
 
 # This list of filenames is used to validate a zip and also when iterating
 # over the extracted zip.
@@ -59,43 +77,137 @@ _not_hex_characters = re.compile(r"[^a-f0-9]", re.I)
 _ignorable_filenames = (".DS_Store",)
 
 
-def check_symbols_archive_file_listing(file_listings):
-    """return a string (the error) if there was something not as expected"""
-    for file_listing in file_listings:
-        for snippet in settings.DISALLOWED_SYMBOLS_SNIPPETS:
-            if snippet in file_listing.name:
-                return (
-                    f"Content of archive file contains the snippet "
-                    f"'{snippet}' which is not allowed"
-                )
-        # Now check that the filename is matching according to these rules:
-        # 1. Either /<name1>/hex/<name2>,
-        # 2. Or, /<name>-symbols.txt
-        # Anything else should be considered and unrecognized file pattern
-        # and thus rejected.
-        split = file_listing.name.split("/")
-        if split[-1] in _ignorable_filenames:
-            continue
-        if len(split) == 3:
-            # Check the symbol and the filename part of it to make sure
-            # it doesn't contain any, considered, invalid S3 characters
-            # when it'd become a key.
-            if invalid_key_name_characters(split[0] + split[2]):
-                return f"Invalid character in filename {file_listing.name!r}"
-            # Check that the middle part is only hex characters.
-            if not _not_hex_characters.findall(split[1]):
-                continue
-        elif len(split) == 1:
-            if file_listing.name.lower().endswith("-symbols.txt"):
-                continue
+@functools.lru_cache()
+def _disallowed_snippets_automaton(snippets):
+    """Build an Aho-Corasick automaton out of all the disallowed snippets.
 
-        # If it didn't get "continued" above, it's an unrecognized file
-        # pattern.
+    Scanning a file name through the automaton finds every snippet in a
+    single pass over the name, instead of one substring scan per snippet.
+    The cache is keyed on the settings value itself so tests that
+    override DISALLOWED_SYMBOLS_SNIPPETS still work.
+    """
+    automaton = ahocorasick.Automaton()
+    for snippet in snippets:
+        automaton.add_word(snippet, snippet)
+    automaton.make_automaton()
+    return automaton
+
+
+@functools.lru_cache()
+def _disallowed_snippets_regex(snippets):
+    """Compile all the disallowed snippets into one alternation regex.
+
+    The snippets are literal strings, so escape them. One regex.search()
+    over the name beats one Python-level substring scan per snippet.
+    """
+    return re.compile("|".join(re.escape(snippet) for snippet in snippets))
+
+
+def find_disallowed_snippet(name):
+    """Return the first disallowed snippet found in 'name', if any."""
+    snippets = tuple(settings.DISALLOWED_SYMBOLS_SNIPPETS)
+    if not snippets:
+        return None
+    if ahocorasick is not None:
+        automaton = _disallowed_snippets_automaton(snippets)
+        for _, snippet in automaton.iter(name):
+            return snippet
+        return None
+    match = _disallowed_snippets_regex(snippets).search(name)
+    return match.group() if match else None
+
+
+def _check_file_listing_name(name):
+    """Return a string (the error) if the file name is not as expected."""
+    snippet = find_disallowed_snippet(name)
+    if snippet:
         return (
-            "Unrecognized file pattern. Should only be <module>/<hex>/<file> "
-            "or <name>-symbols.txt and nothing else. "
-            f"(First unrecognized pattern was {file_listing.name})"
+            f"Content of archive file contains the snippet "
+            f"'{snippet}' which is not allowed"
         )
+    # Now check that the filename is matching according to these rules:
+    # 1. Either /<name1>/hex/<name2>,
+    # 2. Or, /<name>-symbols.txt
+    # Anything else should be considered and unrecognized file pattern
+    # and thus rejected.
+    split = name.split("/")
+    if split[-1] in _ignorable_filenames:
+        return None
+    if len(split) == 3:
+        # Check the symbol and the filename part of it to make sure
+        # it doesn't contain any, considered, invalid S3 characters
+        # when it'd become a key.
+        if invalid_key_name_characters(split[0] + split[2]):
+            return f"Invalid character in filename {name!r}"
+        # Check that the middle part is only hex characters.
+        if not split[1].strip(_hex_characters):
+            return None
+    elif len(split) == 1:
+        if name.lower().endswith("-symbols.txt"):
+            return None
+
+    # If it didn't pass any of the checks above, it's an unrecognized
+    # file pattern.
+    return (
+        "Unrecognized file pattern. Should only be <module>/<hex>/<file> "
+        "or <name>-symbols.txt and nothing else. "
+        f"(First unrecognized pattern was {name})"
+    )
+
+
+def check_symbols_archive_file_listing(file_listings):
+    """Validate the file listing and hash it, in one pass.
+
+    Return a (error, content_hash) tuple. If something was not as
+    expected, 'error' is a string and 'content_hash' is None. Otherwise
+    'error' is None and 'content_hash' is a hash string that represents
+    every file listed in the archive.
+
+    The hash is just used to make the temporary S3 file unique in name
+    if the client uploads with the same filename in quick succession,
+    so it doesn't need to be cryptographic. blake2b is both faster
+    than md5 and lets us ask for exactly the digest size we store.
+    Validation and hashing each need one walk over the (sorted) listing,
+    so do both in the same loop.
+    """
+    hasher = hashlib.blake2b(digest_size=15)
+    for i, file_listing in enumerate(sorted(file_listings, key=lambda x: x.name)):
+        # Validate the name before anything touches the size. A rejected
+        # entry (e.g. one with a path traversal name) might not even
+        # exist on disk after the sanitized extraction.
+        error = _check_file_listing_name(file_listing.name)
+        if error:
+            return error, None
+
+        if i:
+            hasher.update(b"\n")
+        hasher.update(file_listing.name.encode("utf-8"))
+        hasher.update(b":")
+        hasher.update(str(file_listing.size).encode("utf-8"))
+
+    return None, hasher.hexdigest()
+
+
+@functools.lru_cache()
+def _compile_upload_url_exceptions(exceptions):
+    """Given the settings.UPLOAD_URL_EXCEPTIONS dict as a tuple of
+    (pattern, url) pairs, return a dict for the exact (lowercased) email
+    keys and a list of (compiled regex, url) pairs for the wildcard keys.
+
+    fnmatch.fnmatch() translates and compiles the glob on every single
+    call, and we do this lookup on every upload request, so it pays to
+    compile each wildcard exactly once. The cache is keyed on the
+    settings value itself so tests that override the setting still work.
+    """
+    exact = {}
+    wildcards = []
+    for pattern, url in exceptions:
+        pattern = pattern.lower()
+        if any(c in pattern for c in "*?["):
+            wildcards.append((re.compile(fnmatch.translate(pattern)), url))
+        else:
+            exact[pattern] = url
+    return exact, wildcards
 
 
 def get_bucket_info(user, try_symbols=None, preferred_bucket_name=None):
@@ -125,7 +237,6 @@ def get_bucket_info(user, try_symbols=None, preferred_bucket_name=None):
     else:
         url = settings.UPLOAD_DEFAULT_URL
 
-    exceptions = settings.UPLOAD_URL_EXCEPTIONS
     if preferred_bucket_name:
         # If the user has indicated a preferred bucket name, check that they have
         # permission to use it.
@@ -134,16 +245,17 @@ def get_bucket_info(user, try_symbols=None, preferred_bucket_name=None):
                 return StorageBucket(url, try_symbols=try_symbols)
         raise NoPossibleBucketName(preferred_bucket_name)
     else:
-        if user.email.lower() in exceptions:
-            # easy
-            exception = exceptions[user.email.lower()]
-        else:
+        exact, wildcards = _compile_upload_url_exceptions(
+            tuple(settings.UPLOAD_URL_EXCEPTIONS.items())
+        )
+        email = user.email.lower()
+        exception = exact.get(email)
+        if exception is None:
             # match against every possible wildcard
-            exception = None  # assume no match
-            for email_or_wildcard in settings.UPLOAD_URL_EXCEPTIONS:
-                if fnmatch.fnmatch(user.email.lower(), email_or_wildcard.lower()):
+            for regex, exception_url in wildcards:
+                if regex.match(email):
                     # a match!
-                    exception = settings.UPLOAD_URL_EXCEPTIONS[email_or_wildcard]
+                    exception = exception_url
                     break
         if exception:
             url = exception
@@ -170,6 +282,59 @@ def get_possible_bucket_urls(user):
     return urls
 
 
+@functools.lru_cache()
+def _get_upload_clients(endpoint_url, region):
+    """Return a (client, lookup_client) tuple for upload_file_upload,
+    cached per (endpoint_url, region).
+
+    Constructing a boto3 session and client means re-reading credential
+    and service model data, which is far too expensive to do twice on
+    every upload request. The clients are thread-safe so they can be
+    shared between requests and between the upload worker threads.
+
+    The lookup client is configured to be a LOT less patient. That's
+    because we don't want the size lookups to severely accumulate in the
+    case of there being some unpredictable slowness. When that happens
+    the lookup is quickly cancelled and it assumes the file does not
+    exist.
+    See http://botocore.readthedocs.io/en/latest/reference/config.html#botocore.config.Config  # noqa
+    """
+    # TODO(jwhitlock): implement backend details in StorageBucket API
+    client = get_storage_client(
+        endpoint_url=endpoint_url,
+        region_name=region,
+        read_timeout=settings.S3_PUT_READ_TIMEOUT,
+        connect_timeout=settings.S3_PUT_CONNECT_TIMEOUT,
+    )
+    lookup_client = get_storage_client(
+        endpoint_url=endpoint_url,
+        region_name=region,
+        read_timeout=settings.S3_LOOKUP_READ_TIMEOUT,
+        connect_timeout=settings.S3_LOOKUP_CONNECT_TIMEOUT,
+    )
+    return client, lookup_client
+
+
+def _bucket_exists(bucket_info):
+    """Check, with caching, that the destination bucket exists.
+
+    Without the caching, every single upload request pays for a
+    HeadBucket round-trip to S3 before any real work starts, even
+    though the answer practically never changes.
+    Note that only the positive answer is cached. If we cached a
+    negative one, a transient 404 (or a misconfiguration an operator
+    then fixes by creating the bucket) would keep every upload failing
+    until the cache entry expires.
+    """
+    cache_key = f"bucket_exists:{bucket_info.base_url}"
+    if cache.get(cache_key):
+        return True
+    exists = bucket_info.exists()
+    if exists:
+        cache.set(cache_key, True, settings.MEMOIZE_BUCKET_EXISTS_SECONDS)
+    return exists
+
+
 def _ignore_member_file(filename):
     """Return true if the given filename (could be a filepath), should
     be completely ignored in the upload process.
@@ -192,67 +357,63 @@ def _ignore_member_file(filename):
 @make_tempdir(settings.UPLOAD_TEMPDIR_PREFIX)
 def upload_archive(request, upload_dir):
     try:
-        for name in request.FILES:
+        if request.FILES:
+            # Only the first file is used. Uploading clients send one
+            # archive per request.
+            name = next(iter(request.FILES))
             upload_ = request.FILES[name]
             file_listing = dump_and_extract(upload_dir, upload_, name)
             size = upload_.size
             url = None
             redirect_urls = None
-            break
-        else:
-            if request.POST.get("url"):
-                form = UploadByDownloadForm(request.POST)
-                try:
-                    is_valid = form.is_valid()
-                except UploadByDownloadRemoteError as exception:
-                    return http.JsonResponse({"error": str(exception)}, status=500)
-                if is_valid:
-                    url = form.cleaned_data["url"]
-                    name = form.cleaned_data["upload"]["name"]
-                    size = form.cleaned_data["upload"]["size"]
-                    size_fmt = filesizeformat(size)
-                    logger.info(f"Download to upload {url} ({size_fmt})")
-                    redirect_urls = form.cleaned_data["upload"]["redirect_urls"] or None
-                    download_name = os.path.join(upload_dir, name)
-                    with metrics.timer("upload_download_by_url"):
-                        response_stream = requests.get(
-                            url, stream=True, timeout=(5, 300)
-                        )
-                        with open(download_name, "wb") as f:
-                            # Read 1MB at a time
-                            chunk_size = 1024 * 1024
-                            stream = response_stream.iter_content(chunk_size=chunk_size)
-                            count_chunks = 0
-                            start = time.time()
-                            for chunk in stream:
-                                if chunk:  # filter out keep-alive new chunks
-                                    f.write(chunk)
+        elif request.POST.get("url"):
+            form = UploadByDownloadForm(request.POST)
+            try:
+                is_valid = form.is_valid()
+            except UploadByDownloadRemoteError as exception:
+                return http.JsonResponse({"error": str(exception)}, status=500)
+            if is_valid:
+                url = form.cleaned_data["url"]
+                name = form.cleaned_data["upload"]["name"]
+                size = form.cleaned_data["upload"]["size"]
+                size_fmt = filesizeformat(size)
+                logger.info(f"Download to upload {url} ({size_fmt})")
+                redirect_urls = form.cleaned_data["upload"]["redirect_urls"] or None
+                download_name = os.path.join(upload_dir, name)
+                with metrics.timer("upload_download_by_url"):
+                    response_stream = download_session.get(
+                        url, stream=True, timeout=(5, 300)
+                    )
+                    with open(download_name, "wb") as f:
+                        # Read 1MB at a time
+                        chunk_size = 1024 * 1024
+                        stream = response_stream.iter_content(chunk_size=chunk_size)
+                        count_chunks = 0
+                        total_size = 0
+                        start = time.time()
+                        for chunk in stream:
+                            if chunk:  # filter out keep-alive new chunks
+                                f.write(chunk)
+                                total_size += len(chunk)
                                 count_chunks += 1
-                            end = time.time()
-                            total_size = chunk_size * count_chunks
-                            download_speed = size / (end - start)
-                            logger.info(
-                                f"Read {count_chunks} chunks of "
-                                f"{filesizeformat(chunk_size)} each "
-                                f"totalling {filesizeformat(total_size)} "
-                                f"({filesizeformat(download_speed)}/s)."
-                            )
-                    file_listing = dump_and_extract(upload_dir, download_name, name)
-                    os.remove(download_name)
-                else:
-                    for key, errors in form.errors.as_data().items():
-                        return http.JsonResponse(
-                            {"error": errors[0].message}, status=400
+                        end = time.time()
+                        download_speed = total_size / (end - start)
+                        logger.info(
+                            f"Read {count_chunks} chunks of "
+                            f"{filesizeformat(chunk_size)} each "
+                            f"totalling {filesizeformat(total_size)} "
+                            f"({filesizeformat(download_speed)}/s)."
                         )
+                file_listing = dump_and_extract(upload_dir, download_name, name)
+                os.remove(download_name)
             else:
-                return http.JsonResponse(
-                    {
-                        "error": (
-                            "Must be multipart form data with at " "least one file"
-                        )
-                    },
-                    status=400,
-                )
+                for key, errors in form.errors.as_data().items():
+                    return http.JsonResponse({"error": errors[0].message}, status=400)
+        else:
+            return http.JsonResponse(
+                {"error": ("Must be multipart form data with at " "least one file")},
+                status=400,
+            )
     except zipfile.BadZipfile as exception:
         return http.JsonResponse({"error": str(exception)}, status=400)
     except UnrecognizedArchiveFileExtension as exception:
@@ -261,7 +422,7 @@ def upload_archive(request, upload_dir):
         )
     except DuplicateFileDifferentSize as exception:
         return http.JsonResponse({"error": str(exception)}, status=400)
-    error = check_symbols_archive_file_listing(file_listing)
+    error, content_hash = check_symbols_archive_file_listing(file_listing)
     if error:
         return http.JsonResponse({"error": error.strip()}, status=400)
 
@@ -290,24 +451,14 @@ def upload_archive(request, upload_dir):
         # In case it's passed in as a string
         is_try_upload = bool(is_try_upload)
 
-    if not bucket_info.exists():
+    if not _bucket_exists(bucket_info):
         raise ImproperlyConfigured(f"Bucket does not exist: {bucket_info!r}")
 
-    # Create the client for upload_file_upload
-    # TODO(jwhitlock): implement backend details in StorageBucket API
-    client = bucket_info.get_storage_client(
-        read_timeout=settings.S3_PUT_READ_TIMEOUT,
-        connect_timeout=settings.S3_PUT_CONNECT_TIMEOUT,
-    )
-    # Use a different client for doing the lookups.
-    # That's because we don't want the size lookup to severly accumulate
-    # in the case of there being some unpredictable slowness.
-    # When that happens the lookup is quickly cancelled and it assumes
-    # the file does not exist.
-    # See http://botocore.readthedocs.io/en/latest/reference/config.html#botocore.config.Config  # noqa
-    lookup_client = bucket_info.get_storage_client(
-        read_timeout=settings.S3_LOOKUP_READ_TIMEOUT,
-        connect_timeout=settings.S3_LOOKUP_CONNECT_TIMEOUT,
+    # The client for upload_file_upload and a less patient client for
+    # doing the existing-size lookups. Cached per bucket endpoint/region
+    # so we don't construct new boto3 clients on every request.
+    client, lookup_client = _get_upload_clients(
+        bucket_info.endpoint_url, bucket_info.region
     )
 
     # Every key has a prefix. If the StorageBucket instance has it's own prefix
@@ -316,17 +467,6 @@ def upload_archive(request, upload_dir):
     if bucket_info.prefix:
         prefix = f"{bucket_info.prefix}/{prefix}"
 
-    # Make a hash string that represents every file listing in the archive.
-    # Do this by making a string first out of all files listed.
-
-    content = "\n".join(
-        "{}:{}".format(x.name, x.size)
-        for x in sorted(file_listing, key=lambda x: x.name)
-    )
-    # The MD5 is just used to make the temporary S3 file unique in name
-    # if the client uploads with the same filename in quick succession.
-    content_hash = hashlib.md5(content.encode("utf-8")).hexdigest()[:30]  # nosec
-
     # Always create the Upload object no matter what happens next.
     # If all individual file uploads work out, we say this is complete.
     upload_obj = Upload.objects.create(
@@ -414,17 +554,35 @@ def upload_archive(request, upload_dir):
 
 
 def _serialize_upload(upload):
+    # One .values() query gives us plain dict values (with the user's
+    # email joined in) instead of a round of model attribute descriptor
+    # lookups, and it re-reads the row so the response reflects the
+    # skipped_keys/completed_at update done just before serializing.
+    values = Upload.objects.values(
+        "id",
+        "size",
+        "filename",
+        "bucket_name",
+        "bucket_region",
+        "download_url",
+        "try_symbols",
+        "redirect_urls",
+        "completed_at",
+        "created_at",
+        "user__email",
+        "skipped_keys",
+    ).get(id=upload.id)
     return {
-        "id": upload.id,
-        "size": upload.size,
-        "filename": upload.filename,
-        "bucket": upload.bucket_name,
-        "region": upload.bucket_region,
-        "download_url": upload.download_url,
-        "try_symbols": upload.try_symbols,
-        "redirect_urls": upload.redirect_urls or [],
-        "completed_at": upload.completed_at,
-        "created_at": upload.created_at,
-        "user": upload.user.email,
-        "skipped_keys": upload.skipped_keys or [],
+        "id": values["id"],
+        "size": values["size"],
+        "filename": values["filename"],
+        "bucket": values["bucket_name"],
+        "region": values["bucket_region"],
+        "download_url": values["download_url"],
+        "try_symbols": values["try_symbols"],
+        "redirect_urls": values["redirect_urls"] or [],
+        "completed_at": values["completed_at"],
+        "created_at": values["created_at"],
+        "user": values["user__email"],
+        "skipped_keys": values["skipped_keys"] or [],
     }
@@ -59,12 +59,19 @@ INIT_CASES = {
 }
 
 
+@pytest.fixture(scope="module")
+def init_case_buckets():
+    """Parse each INIT_CASES URL into a StorageBucket just once for the
+    whole module, instead of once per parametrized assertion case."""
+    return {url: StorageBucket(url) for url in INIT_CASES}
+
+
 @pytest.mark.parametrize(
     "url, expected", INIT_CASES.items(), ids=tuple(INIT_CASES.keys())
 )
-def test_init(url, expected):
+def test_init(init_case_buckets, url, expected):
     """The URL is processed during initialization."""
-    bucket = StorageBucket(url)
+    bucket = init_case_buckets[url]
     assert bucket.backend == expected["backend"]
     assert bucket.base_url == expected["base_url"]
     assert bucket.endpoint_url == expected["endpoint_url"]
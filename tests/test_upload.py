@@ -312,7 +312,7 @@ def test_upload_archive_happy_path(
         assert upload.size == 70398
         # This is predictable and shouldn't change unless the fixture
         # file used changes.
-        assert upload.content_hash == "984270ef458d9d1e27e8d844ad52a9"
+        assert upload.content_hash == "46a6f27ba860e44fd3d246a4aefdde"
         assert upload.bucket_name == "private"
         assert upload.bucket_region is None
         assert upload.bucket_endpoint_url == "https://s3.example.com"
@@ -471,7 +471,7 @@ def test_upload_try_symbols_happy_path(
         assert upload.size == 70398
         # This is predictable and shouldn't change unless the fixture
         # file used changes.
-        assert upload.content_hash == "984270ef458d9d1e27e8d844ad52a9"
+        assert upload.content_hash == "46a6f27ba860e44fd3d246a4aefdde"
         assert upload.bucket_name == "try"
         assert upload.bucket_region is None
         assert upload.bucket_endpoint_url == "https://s3.example.com"